@@ -1,9 +1,22 @@
 import os
 import json
 import random
+import re
 import argparse
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    # 未安装 orjson 时使用标准库 json 写出，结果相同但速度较慢
+    orjson = None
+
+# 思考文件中转义的 <__THINK__> / </__THINK__> 标签，一次遍历还原为 <think> / </think>
+_THINK_RE = re.compile(r'<(/?)__THINK__>')
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="构建指令微调(IFT)数据集 (JSON格式)")
@@ -11,6 +24,8 @@ def parse_arguments():
     parser.add_argument("--report_dir", type=str, default="./report_by_llm", help="模型生成结果(报告+思考)所在目录")
     parser.add_argument("--instruction_file", type=str, default="./prompt/instruction.txt", help="存放指令的文件路径")
     parser.add_argument("--output_file", type=str, default="finetune_data.json", help="最终生成的 JSON 文件路径")
+    parser.add_argument("--jsonl", action="store_true", help="输出为 JSON Lines 格式（每行一条样本）")
+    parser.add_argument("--seed", type=int, default=None, help="打乱样本顺序的随机种子，指定后结果可复现")
     
     # 日期参数
     parser.add_argument("--start_date", type=str, default="2021-01-01", help="开始日期 (YYYY-MM-DD)")
@@ -21,18 +36,35 @@ def parse_arguments():
 def generate_timestamps(start_date, end_date):
     """生成时间戳列表 YYYY-MM-DD_HHMMSS"""
     current_date = start_date
-    date_format = "%Y-%m-%d"
-    time_format = "%H%M%S"
     hours = [5, 11, 17, 20]
     formatted_timestamps = []
 
+    # 每天只格式化一次日期，时分秒直接拼接
     while current_date <= end_date:
-        for hour in hours:
-            dt_object = datetime(current_date.year, current_date.month, current_date.day, hour)
-            formatted_timestamps.append(f"{dt_object.strftime(date_format)}_{dt_object.strftime(time_format)}")
+        day_str = current_date.strftime("%Y-%m-%d")
+        formatted_timestamps.extend(f"{day_str}_{hour:02d}0000" for hour in hours)
         current_date += timedelta(days=1)
     return formatted_timestamps
 
+def dump_record(record, indent=False):
+    """将单条样本序列化为保留中文的 UTF-8 字节串，indent 为 True 时缩进 2 格"""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(record, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+def bounded_map(ex, fn, items, window):
+    """
+    与 ex.map 相同按顺序返回结果，但同时最多只提交 window 个任务。
+    ex.map 会一次提交全部任务，读取快于写出时已完成的样本会堆积在内存中。
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(ex.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
 def load_instruction(file_path):
     """读取指令文件，如果不存在则使用默认指令"""
     if not os.path.exists(file_path):
@@ -42,6 +74,48 @@ def load_instruction(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read().strip()
 
+def process_ts(ts, csv_dir, report_dir, instruction_text):
+    """
+    读取单个时次的 CSV、报告和思考过程并组装为一条微调样本。
+
+    返回:
+    tuple: (样本 dict, 是否缺失文件)。文件缺失时为 (None, True)，读取出错时为 (None, False)。
+    """
+    csv_path = Path(csv_dir) / f"{ts}.csv"
+    report_path = Path(report_dir) / f"{ts}.txt"
+    think_path = Path(report_dir) / f"{ts}_think.txt"
+
+    # 直接读取并捕获 FileNotFoundError，省去单独的 exists 检查
+    try:
+        input_data = csv_path.read_text(encoding='utf-8')
+        report_data = report_path.read_text(encoding='utf-8')
+
+        try:
+            think_content = think_path.read_text(encoding='utf-8').strip()
+        except FileNotFoundError:
+            think_content = None
+
+    except FileNotFoundError:
+        return None, True
+    except Exception as e:
+        print(f"处理 {ts} 时出错: {e}")
+        return None, False
+
+    if think_content is None:
+        final_output = report_data
+    elif "<think>" in think_content:
+        if '__THINK__' in think_content:
+            think_content = _THINK_RE.sub(lambda m: f'<{m.group(1)}think>', think_content)
+        final_output = f"{think_content}\n\n{report_data}"
+    else:
+        final_output = f"<think>\n{think_content}\n</think>\n\n{report_data}"
+
+    return {
+        "instruction": instruction_text,
+        "input": input_data,
+        "output": final_output
+    }, False
+
 def main():
     args = parse_arguments()
     
@@ -61,55 +135,39 @@ def main():
     instruction_text = load_instruction(args.instruction_file)
     timestamps = generate_timestamps(s_date, e_date)
     
-    data_ift = []
+    # 打乱时次顺序即可打乱样本顺序，样本逐条写出，不在内存中累积整个数据集
+    rng = random.Random(args.seed)
+    rng.shuffle(timestamps)
+
     success_count = 0
     missing_count = 0
 
     print(f"--- 开始构建数据集 ({args.start_date} ~ {args.end_date}) ---")
 
-    for ts in timestamps:
-        csv_path = os.path.join(args.csv_dir, f"{ts}.csv")
-        report_path = os.path.join(args.report_dir, f"{ts}.txt")
-        think_path = os.path.join(args.report_dir, f"{ts}_think.txt")
-
-        if not os.path.exists(csv_path) or not os.path.exists(report_path):
-            missing_count += 1
-            continue
-
-        try:
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                input_data = f.read()
-
-            with open(report_path, 'r', encoding='utf-8') as f:
-                report_data = f.read()
-
-            final_output = ""
-            if os.path.exists(think_path):
-                with open(think_path, 'r', encoding='utf-8') as f:
-                    think_content = f.read().strip()
-                    
-                if "<think>" in think_content:
-                    think_content = think_content.replace('<__THINK__>', '<think>').replace('</__THINK__>', '</think>')
-                    final_output = f"{think_content}\n\n{report_data}"
-                else:
-                    final_output = f"<think>\n{think_content}\n</think>\n\n{report_data}"
+    # 各时次的文件读取相互独立，用线程池重叠 I/O 等待；预读窗口限制为线程数的 2 倍，内存占用与数据集大小无关
+    max_workers = 32
+    with open(args.output_file, 'wb') as f, ThreadPoolExecutor(max_workers=max_workers) as ex:
+        if not args.jsonl:
+            f.write(b'[')
+
+        read_ts = lambda ts: process_ts(ts, args.csv_dir, args.report_dir, instruction_text)
+        for record, missing in bounded_map(ex, read_ts, timestamps, 2 * max_workers):
+            if missing:
+                missing_count += 1
+                continue
+            if record is None:
+                continue
+
+            if args.jsonl:
+                f.write(dump_record(record) + b'\n')
             else:
-                final_output = report_data
-
-            data_ift.append({
-                "instruction": instruction_text,
-                "input": input_data,
-                "output": final_output
-            })
+                # 与 json.dump(indent=2) 的排版一致：样本整体再缩进一级
+                f.write(b',\n  ' if success_count else b'\n  ')
+                f.write(dump_record(record, indent=True).replace(b'\n', b'\n  '))
             success_count += 1
 
-        except Exception as e:
-            print(f"处理 {ts} 时出错: {e}")
-
-    random.shuffle(data_ift)
-    
-    with open(args.output_file, 'w', encoding='utf-8') as f:
-        json.dump(data_ift, f, ensure_ascii=False, indent=2)
+        if not args.jsonl:
+            f.write(b'\n]' if success_count else b']')
 
     print(f"--- 构建完成 ---")
     print(f"✅ 成功条目: {success_count}")
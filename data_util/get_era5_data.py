@@ -1,30 +1,103 @@
-import xarray as xr 
-import os 
-
-def get_era5_data_by_vars(file_path, var_name): 
-    if not os.path.exists(file_path): 
-        print(f"Error: The file at '{file_path}' was not found.") 
-        return None 
- 
-    try: 
-        print(f"Reading GRIB file: {file_path}") 
-        ds = xr.open_dataset(file_path, engine='cfgrib') 
-        
-        if var_name in ds.data_vars: 
-            ds_value = ds[[var_name]] 
-            print(f"\n--- Dataset for variable: {var_name} ---") 
-            print(ds_value) 
-            return ds_value 
-        else: 
-            ds_value = ds_value = xr.open_dataset(
-                file_path, 
-                engine='cfgrib', 
-                backend_kwargs={'filter_by_keys': {'shortName': var_name}})
-            print(f"\n--- Dataset for variable: {var_name} ---") 
-            print(ds_value) 
+import functools
+import numpy as np
+import xarray as xr
+import os
+
+# cfgrib 在 GRIB 文件旁写入 .idx 索引，跨进程复用，避免每次打开都重新扫描。
+# 按变量过滤时索引键不同，文件名必须带 short_hash，否则不同打开方式会互相覆盖索引。
+# 索引中记录了打开时的路径字符串，路径写法不同（./raw_data 与 raw_data）也会被判为不兼容，
+# 因此统一转换为绝对路径再打开
+GRIB_INDEXPATH = '{path}.{short_hash}.idx'
+
+
+def zarr_path_for(file_path):
+    """
+    GRIB 文件对应的 Zarr 存储路径，例如 raw_data/land.grib -> raw_data/land.zarr
+    """
+    return os.path.splitext(file_path)[0] + '.zarr'
+
+
+@functools.lru_cache(maxsize=32)
+def _open_grib(file_path, var_name_or_none=None):
+    """
+    打开 GRIB 文件并缓存结果。
+    var_name_or_none 为 None 时读取全部变量，否则按 cfVarName（即 xarray 中的变量名，如 t2m）过滤。
+    """
+    print(f"Reading GRIB file: {file_path}")
+    backend_kwargs = {'indexpath': GRIB_INDEXPATH}
+    if var_name_or_none is not None:
+        backend_kwargs['filter_by_keys'] = {'cfVarName': var_name_or_none}
+    return xr.open_dataset(file_path, engine='cfgrib', backend_kwargs=backend_kwargs)
+
+
+@functools.lru_cache(maxsize=32)
+def _open_zarr(zarr_path, var_name):
+    """
+    打开由 grib_to_zarr 生成的 Zarr 存储中某个变量的分组并缓存结果。
+    """
+    print(f"Reading Zarr store: {zarr_path} [{var_name}]")
+    return xr.open_zarr(zarr_path, group=var_name, consolidated=True, chunks={})
+
+
+def get_era5_data_by_vars(file_path, var_name):
+    # 优先读取预先转换好的 Zarr 存储（见 data_util/grib_to_zarr.py）
+    zarr_path = zarr_path_for(file_path)
+    if os.path.isdir(os.path.join(zarr_path, var_name)):
+        try:
+            ds_value = _open_zarr(zarr_path, var_name)[[var_name]]
+            print(f"\n--- Dataset for variable: {var_name} ---")
+            print(ds_value)
             return ds_value
- 
-    except Exception as e: 
-        print(f"An error occurred while trying to read the GRIB file: {e}") 
-        print("Please ensure 'cfgrib', 'xarray', and 'eccodes' are correctly installed.") 
-        return None  
+        except Exception as e:
+            print(f"An error occurred while trying to read the Zarr store: {e}")
+            print("Falling back to the GRIB file.")
+
+    if not os.path.exists(file_path):
+        print(f"Error: The file at '{file_path}' was not found.")
+        return None
+
+    try:
+        file_path = os.path.abspath(file_path)
+        # 先按变量过滤打开，只构建该变量的数据集；过滤失败或没有该变量时再读取全部变量
+        try:
+            ds = _open_grib(file_path, var_name)
+        except Exception as e:
+            print(f"Filtered read of '{var_name}' failed ({e}), reading all variables.")
+            ds = None
+
+        if ds is None or var_name not in ds.data_vars:
+            ds = _open_grib(file_path)
+        ds_value = ds[[var_name]]
+        print(f"\n--- Dataset for variable: {var_name} ---")
+        print(ds_value)
+        return ds_value
+
+    except Exception as e:
+        print(f"An error occurred while trying to read the GRIB file: {e}")
+        print("Please ensure 'cfgrib', 'xarray', and 'eccodes' are correctly installed.")
+        return None
+
+
+def to_valid_time(da, time_slice=None):
+    """
+    将 ERA5 累积量/时段极值（tp、sf、cp、i10fg 等）的 (time, step) 两维展开为按有效时间
+    (time + step) 排列的单一 time 维，使其与 t2m、tcc 等逐小时变量处于同一时间轴。
+    不含 step 维的数据原样返回。
+
+    time_slice 为有效时间窗口（slice），给定时先按起报时间粗筛再展开，避免读入整个文件。
+    """
+    if 'step' not in da.dims:
+        return da if time_slice is None else da.sel(time=time_slice)
+
+    if time_slice is not None:
+        max_step = da['step'].values.max()
+        da = da.sel(time=slice(np.datetime64(time_slice.start) - max_step, time_slice.stop))
+
+    stacked = da.stack(valid=('time', 'step')).transpose('valid', ...)
+    valid_time = (stacked['time'] + stacked['step']).values
+    stacked = stacked.drop_vars(['valid', 'time', 'step', 'valid_time'], errors='ignore')
+    stacked = stacked.rename({'valid': 'time'}).assign_coords(time=valid_time).sortby('time')
+
+    if time_slice is not None:
+        stacked = stacked.sel(time=time_slice)
+    return stacked
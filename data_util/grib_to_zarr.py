@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import xarray as xr
+from data_util.get_era5_data import GRIB_INDEXPATH, zarr_path_for
+
+# generate_csv.py 用到的变量
+LAND_VARS = ['t2m', 'd2m', 'u10', 'v10', 'i10fg', 'tcc', 'lcc', 'tp', 'sf', 'cp']
+LEVEL_VARS = ['r']
+
+# 时间维整块存放，经纬度切成小块，读取上海附近区域时只触及少量分块
+ZARR_CHUNKS = {'time': -1, 'latitude': 16, 'longitude': 16}
+
+
+def convert_grib_to_zarr(grib_file, var_names, zarr_path=None):
+    """
+    将 GRIB 文件一次性转换为分块的 Zarr 存储，每个变量写入同名分组。
+
+    参数:
+    - grib_file (str): GRIB 文件路径。
+    - var_names (list): 需要转换的变量名（cfVarName，如 t2m、tp）列表，文件中不存在的变量会被跳过。
+    - zarr_path (str): 输出路径，默认与 GRIB 文件同名、扩展名为 .zarr。
+
+    返回:
+    - list: 实际写入的变量名列表。
+    """
+    if zarr_path is None:
+        zarr_path = zarr_path_for(grib_file)
+
+    written = []
+    for var_name in var_names:
+        try:
+            ds = xr.open_dataset(
+                os.path.abspath(grib_file),
+                engine='cfgrib',
+                backend_kwargs={'filter_by_keys': {'cfVarName': var_name}, 'indexpath': GRIB_INDEXPATH})
+        except Exception as e:
+            print(f"  ⚠️ 跳过 {var_name}: 读取失败 ({e})")
+            continue
+
+        if var_name not in ds.data_vars:
+            print(f"  ⚠️ 跳过 {var_name}: 文件中不存在该变量")
+            continue
+
+        chunks = {dim: size for dim, size in ZARR_CHUNKS.items() if dim in ds.dims}
+        ds[[var_name]].chunk(chunks).to_zarr(zarr_path, group=var_name, mode='w', consolidated=True)
+        print(f"  {var_name} -> {zarr_path}/{var_name}")
+        written.append(var_name)
+
+    return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="将 ERA5 GRIB 文件转换为分块的 Zarr 存储")
+
+    parser.add_argument("--land_file", type=str, default='./raw_data/land.grib', help="地面层 GRIB 文件路径")
+    parser.add_argument("--level_file", type=str, default='./raw_data/level.grib', help="高空层 GRIB 文件路径")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if not os.path.exists(args.land_file) or not os.path.exists(args.level_file):
+        print(f"❌ 错误: 输入数据文件不存在。请检查路径:\n  - {args.land_file}\n  - {args.level_file}")
+        sys.exit(1)
+
+    print("--- 开始转换 GRIB -> Zarr ---")
+    convert_grib_to_zarr(args.land_file, LAND_VARS)
+    convert_grib_to_zarr(args.level_file, LEVEL_VARS)
+    print("--- 转换完成 ---")
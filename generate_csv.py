@@ -4,20 +4,37 @@ import os
 import re
 import sys
 import numpy as np
-import pandas as pd
-from data_util.get_era5_data import get_era5_data_by_vars
-from datetime import datetime, timedelta
-import pytz
-from metpy.calc import relative_humidity_from_dewpoint
-from metpy.units import units
+import xarray as xr
+from data_util.get_era5_data import get_era5_data_by_vars, to_valid_time
+from data_util.grib_to_zarr import LAND_VARS, LEVEL_VARS
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # 未安装 numba 时 njit 不做任何事，降水统计改用 _rain_counts_numpy
+    def njit(*args, **kwargs):
+        return lambda func: func
+    prange = range
+    NUMBA_AVAILABLE = False
+
+# 降水分类阈值，与 float32 数据比较时保持 float32 精度
+_F32_01 = np.float32(0.1)
+_F32_2 = np.float32(2)
+_F32_5 = np.float32(5)
+
+# 时区对象只构造一次；zoneinfo 由 C 实现，且不需要 pytz 的 localize
+_BEIJING = ZoneInfo('Asia/Shanghai')
+_UTC = timezone.utc
 
 def utc_to_beijing(utc_time):
     if isinstance(utc_time, str):
         utc_time = datetime.fromisoformat(utc_time.replace('Z', '+00:00'))
     
-    utc_time = utc_time.replace(tzinfo=pytz.UTC)
-    beijing_tz = pytz.timezone('Asia/Shanghai')
-    beijing_time = utc_time.astimezone(beijing_tz)
+    utc_time = utc_time.replace(tzinfo=_UTC)
+    beijing_time = utc_time.astimezone(_BEIJING)
     
     return beijing_time
 
@@ -26,9 +43,8 @@ def beijing_to_utc(beijing_time):
     if isinstance(beijing_time, str):
         beijing_time = datetime.fromisoformat(beijing_time)
     
-    beijing_tz = pytz.timezone('Asia/Shanghai')
-    beijing_time = beijing_tz.localize(beijing_time) if beijing_time.tzinfo is None else beijing_time
-    utc_time = beijing_time.astimezone(pytz.UTC)
+    beijing_time = beijing_time.replace(tzinfo=_BEIJING) if beijing_time.tzinfo is None else beijing_time
+    utc_time = beijing_time.astimezone(_UTC)
     return utc_time
 
 
@@ -64,94 +80,156 @@ def generate_three_hour_intervals(start_time_str, format_str="%Y-%m-%dT%H:%M:%S"
 
     return time_intervals
 
-def get_temperature_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%m-%dT%H:%M:%S"):
+def prepare_intervals(start_time_str, format_str="%Y-%m-%dT%H:%M:%S"):
     """
-    计算气温
-    05、11时取今天最高，明天最低；17、21时取明天最高、明天最低
+    生成各 3 小时时段并一次性转换为 UTC，供同一预报时次的所有计算函数共用。
+
+    参数:
+    start_time_str (str): 起始时间（北京时间）字符串。
+    format_str (str): 输入时间字符串的格式。
+
+    返回:
+    list: 每个时段 (起始, 结束) 的 UTC datetime 元组（不带时区信息）。
     """
-    temperature_ds = get_era5_data_by_vars(grib_file, "t2m")
+    return [(beijing_to_utc(datetime.strptime(start, format_str)).replace(tzinfo=None),
+             beijing_to_utc(datetime.strptime(end, format_str)).replace(tzinfo=None))
+            for start, end in generate_three_hour_intervals(start_time_str, format_str=format_str)]
 
-    if temperature_ds is None:
-        print("无法获取温度数据，请检查文件路径或变量名。")
-        return [], []
 
-    if temperature_ds['time'].dtype == 'O':
-        temperature_ds['time'] = temperature_ds['time'].astype('datetime64[ns]')
+def bin_edges_by_3h(times, intervals_utc):
+    """
+    计算各 3 小时时段在时间轴上的下标边界。
 
-    max_temps_c = []
-    min_temps_c = []
+    参数:
+    times (numpy.ndarray): 升序的 datetime64 时间轴（UTC）。
+    intervals_utc (list): prepare_intervals 返回的 UTC 时段列表。
+
+    返回:
+    numpy.ndarray: 长度为 时段数+1 的下标数组，第 b 个时段为 times[edges[b]:edges[b+1]]（左闭右开）。
+    """
+    edges_utc = np.array([start for start, _ in intervals_utc] + [intervals_utc[-1][1]],
+                         dtype='datetime64[ns]')
+    return np.searchsorted(times, edges_utc, side='left').astype(np.int64)
 
-    time_intervals = generate_three_hour_intervals(time_str, format_str=format_str)
-    for start_time_bjt, end_time_bjt in time_intervals:
-        start_utc_str = beijing_to_utc(start_time_bjt).strftime(format_str)
-        end_utc_str = beijing_to_utc(end_time_bjt).strftime(format_str)
 
-        regional_temp = temperature_ds.sel(time=slice(start_utc_str, end_utc_str))
-        regional_temp = regional_temp.sel(latitude=lat_range, longitude=lon_range)
+def reduce_by_3h(arr, bin_edges, func):
+    """
+    按时段下标边界对 (time, ...) 数组逐段归约，切片均为视图，不复制数据。
+    返回与时段一一对应的数组，时段内没有数据时为 NaN。
+    """
+    reduced = np.full(len(bin_edges) - 1, np.nan)
+    for b in range(len(reduced)):
+        if bin_edges[b + 1] > bin_edges[b]:
+            reduced[b] = func(arr[bin_edges[b]:bin_edges[b + 1]])
+    return reduced
 
-        if regional_temp['t2m'].size > 0:
-            max_temp_k = regional_temp['t2m'].max().item()
-            min_temp_k = regional_temp['t2m'].min().item()
 
-            max_temp_c = max_temp_k - 273.15
-            min_temp_c = min_temp_k - 273.15
+def preload_window(sources, start_utc, end_utc, lat_range, lon_range):
+    """
+    一次性读取时间窗口 × 区域内用到的全部变量并载入内存，之后的计算全部基于 NumPy 数组，
+    不再反复对整个文件做 sel。
 
-            max_temps_c.append(max_temp_c)
-            min_temps_c.append(min_temp_c)
-        else:
-            max_temps_c.append(None)
-            min_temps_c.append(None)
+    参数:
+    sources (dict): {GRIB 文件路径: [变量名, ...]}。
+    start_utc, end_utc (datetime): 时间窗口（UTC，两端均包含）。
+    lat_range, lon_range (slice): 区域范围。
 
-    return max_temps_c, min_temps_c
+    返回:
+    dict: 变量名 -> numpy.ndarray，形状为 (time, latitude, longitude)，高空变量为
+    (time, isobaricInhPa, latitude, longitude)；另含 'time'、'latitude'、'longitude'
+    以及存在时的 'isobaricInhPa' 坐标。任一变量读取失败时返回 None。
+    """
+    window = slice(start_utc, end_utc)
+    arrays = []
+    for grib_file, var_names in sources.items():
+        for var_name in var_names:
+            ds = get_era5_data_by_vars(grib_file, var_name)
+            if ds is None:
+                print(f"无法获取 {var_name} 数据，请检查文件路径或变量名。")
+                return None
+            da = ds[var_name]
+            if da['time'].dtype == 'O':
+                da = da.assign_coords(time=da['time'].astype('datetime64[ns]'))
+            arrays.append(to_valid_time(da.sel(latitude=lat_range, longitude=lon_range), window))
+
+    # 所有变量对齐到同一时间轴和网格，之后可以直接按下标运算
+    arrays = xr.align(*arrays, join='inner')
+    data = {da.name: da.transpose('time', ..., 'latitude', 'longitude').values for da in arrays}
+    for coord in ('time', 'latitude', 'longitude', 'isobaricInhPa'):
+        for da in arrays:
+            if coord in da.dims:
+                data[coord] = da[coord].values
+                break
+
+    return data
+
+
+def convert_units(data):
+    """
+    对 preload_window 的结果原地换算单位：t2m、d2m 由 K 转为 ℃，tp、sf、cp 由 m 转为 mm。
+    这些数组是读取时新建的副本，原地修改不会影响已缓存的数据集，也不产生临时数组。
+    """
+    for name in ('t2m', 'd2m'):
+        data[name] -= 273.15
+    for name in ('tp', 'sf', 'cp'):
+        data[name] *= 1000
+    return data
 
 
-def get_rh_by_days(grib_file, time_str, target_lat, target_lon, format_str = "%Y-%m-%dT%H:%M:%S"):
+def slice_window(data, start_utc, end_utc):
     """
-    计算相对湿度
-    提取徐家汇（lon=121.4317，lat=31.1922）的露点温度DPT_2M
-    根据露点温度和最高、最低气温计算最低rhmin和最高相对湿度rhmax（用metpy中的relative_humidity_from_dewpoint函数）
+    从 preload_window 的结果中截取 [start_utc, end_utc] 时段（两端均包含）。
+    各变量按时间维切片，返回的均为视图，不复制数据。
     """
-    time_intervals = generate_three_hour_intervals(time_str, format_str=format_str)
+    lo, hi = (np.searchsorted(data['time'], np.datetime64(start_utc, 'ns'), side='left'),
+              np.searchsorted(data['time'], np.datetime64(end_utc, 'ns'), side='right'))
+    return {name: arr if name in ('latitude', 'longitude', 'isobaricInhPa') else arr[lo:hi]
+            for name, arr in data.items()}
 
-    start_time_utc = beijing_to_utc(time_intervals[0][0]).replace(tzinfo=None)
-    end_time_utc = beijing_to_utc(time_intervals[-1][-1]).replace(tzinfo=None)
 
-    temperature_ds = get_era5_data_by_vars(grib_file, "t2m")
-    dewpoint_ds = get_era5_data_by_vars(grib_file, "d2m")
-    if temperature_ds is None or dewpoint_ds is None:
-        print("无法获取温度或露点数据，请检查文件路径或变量名。")
-        return None, None
+def get_temperature_by_3h(data, intervals_utc):
+    """
+    计算气温
+    05、11时取今天最高，明天最低；17、21时取明天最高、明天最低
+    """
+    bin_edges = bin_edges_by_3h(data['time'], intervals_utc)
+    max_temps_c = reduce_by_3h(data['t2m'], bin_edges, np.nanmax).tolist()
+    min_temps_c = reduce_by_3h(data['t2m'], bin_edges, np.nanmin).tolist()
 
-    t2m_da = temperature_ds["t2m"]
-    d2m_da = dewpoint_ds["d2m"]
+    return max_temps_c, min_temps_c
 
-    t2m_slice = t2m_da.sel(time=slice(start_time_utc, end_time_utc))
-    d2m_slice = d2m_da.sel(time=slice(start_time_utc, end_time_utc))
 
-    t2m_point = t2m_slice.sel(longitude=target_lon, latitude=target_lat, method="nearest")
-    d2m_point = d2m_slice.sel(longitude=target_lon, latitude=target_lat, method="nearest")
+def get_rh_by_days(data, target_lat, target_lon):
+    """
+    计算相对湿度
+    提取徐家汇（lon=121.4317，lat=31.1922）的露点温度DPT_2M
+    根据露点温度和气温计算最低rhmin和最高相对湿度rhmax
+    饱和水汽压用 Magnus 公式（Bolton 1980 系数）：es = 6.112 * exp(17.67 * T / (T + 243.5))，rh = es(Td) / es(T)
+    """
+    # 预加载窗口即为整个预报时段，取离目标点最近的格点
+    lat_idx = np.abs(data['latitude'] - target_lat).argmin()
+    lon_idx = np.abs(data['longitude'] - target_lon).argmin()
 
-    t2m_c = t2m_point - 273.15
-    d2m_c = d2m_point - 273.15
+    t2m_c = data['t2m'][:, lat_idx, lon_idx]
+    d2m_c = data['d2m'][:, lat_idx, lon_idx]
 
-    rh = relative_humidity_from_dewpoint(
-        t2m_c.values * units.degC,
-        d2m_c.values * units.degC
-    )
+    es_t = 6.112 * np.exp(17.67 * t2m_c / (t2m_c + 243.5))
+    es_d = 6.112 * np.exp(17.67 * d2m_c / (d2m_c + 243.5))
+    rh = es_d / es_t
 
-    rhmax = np.max(rh).magnitude * 100
-    rhmin = np.min(rh).magnitude * 100
+    rhmax = np.nanmax(rh) * 100
+    rhmin = np.nanmin(rh) * 100
 
     return rhmin, rhmax
 
 
-def get_wdir_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%m-%dT%H:%M:%S"):
+def get_wdir_by_3h(data, intervals_utc):
     """
     计算指定时间段内的平均风向。
 
-    首先，函数会根据传入的 `time_str` 和 `format_str` 确定一个24小时的时间段，
-    即从 `time_str` 当天开始，到第二天20:00（北京时间）为止。然后，它会
-    从 GRIB 文件中提取该时间段内所有时刻的 u10 和 v10 数据，并计算它们的
+    首先，函数按传入的 `intervals_utc` 确定各时段，即从预报起始时刻开始，
+    到第二天20:00（北京时间）为止。然后，它会
+    从预加载的数据中提取每个 3 小时时段内所有时刻的 u10 和 v10，并计算它们的
     时间平均值，以得到每个格点上的平均风矢量 (u, v)。
 
     最后，根据风向的定义，使用以下公式计算平均风向 (wdir)：
@@ -162,180 +240,93 @@ def get_wdir_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%
     的调整以得到风吹来的方向。
 
     参数:
-    - grib_file (str): GRIB 文件的路径。
-    - time_str (str): 包含日期的字符串，格式由 `format_str` 指定。
-    - format_str (str): 用于解析 `time_str` 的时间格式。
+    - data (dict): preload_window 返回的预加载数据。
+    - intervals_utc (list): prepare_intervals 返回的 UTC 时段列表。
 
     返回:
-    - numpy.ndarray: 包含每个格点平均风向的二维数组。
+    - list: 每个时段的区域平均风向。
     """
-
-    intervals = generate_three_hour_intervals(time_str, format_str=format_str)
+    bin_edges = bin_edges_by_3h(data['time'], intervals_utc)
+    deg = 180.0 / np.pi
 
     wdir_list = []
-    u10_ds = get_era5_data_by_vars(grib_file, "u10")
-    v10_ds = get_era5_data_by_vars(grib_file, "v10")
-    if u10_ds is None or v10_ds is None:
-        print("无法获取风向数据，请检查文件路径或变量名。")
-        return None
-
-    u10_da = u10_ds["u10"]
-    v10_da = v10_ds["v10"]
-
-    for interval_start, interval_end in intervals:
-        start_utc = beijing_to_utc(interval_start).replace(tzinfo=None)
-        end_utc = beijing_to_utc(interval_end).replace(tzinfo=None)
-        u_slice = u10_da.sel(time=slice(start_utc, end_utc)).sel(latitude=lat_range, longitude=lon_range)
-        v_slice = v10_da.sel(time=slice(start_utc, end_utc)).sel(latitude=lat_range, longitude=lon_range)
+    for start, end in zip(bin_edges[:-1], bin_edges[1:]):
+        if end <= start:
+            wdir_list.append(np.nan)
+            continue
         # 时间均值
-        u = u_slice.mean(dim='time')
-        v = v_slice.mean(dim='time')
-        deg = 180.0 / np.pi
+        u = np.nanmean(data['u10'][start:end], axis=0)
+        v = np.nanmean(data['v10'][start:end], axis=0)
         wdir = 180.0 + np.arctan2(u, v) * deg
         # 所有经纬度均值
-        wdir_mean = wdir.mean().item()
-        wdir_list.append(wdir_mean)
+        wdir_list.append(float(np.nanmean(wdir)))
 
     return wdir_list
 
 
-def get_uvg_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%m-%dT%H:%M:%S"):
+# 阵风风速(m/s)分级：风速落在 [_WS_EDGES[i], _WS_EDGES[i+1]) 时取 _WS_SCALES[i]，
+# 负值、缺测和超出上限(>=61.3)均为 NaN
+_WS_EDGES = np.array([0, 5.0, 8.0, 10, 12, 14, 16, 18, 20, 22, 26, 27.5, 28.5, 30, 31.5, 33.5, 35.5,
+                      37.5, 39.5, 41.5, 43.9, 46.2, 48.7, 51.0, 53.6, 56.1, 58.7, 61.3])
+_WS_SCALES = np.array([2, 4, 5, 6, 6.5, 7, 7.5, 8, 8.5, 9, 9.5, 10, 10.5, 11, 11.5, 12, 12.5,
+                       13, 13.5, 14, 14.5, 15, 15.5, 16, 16.5, 17, 17.5, np.nan])
+
+
+def ws2scale_city(ws):
+    """
+    将风速（标量或数组）一次性转换为城市风力等级
+    """
+    idx = np.digitize(ws, _WS_EDGES) - 1
+    idx = np.where(idx < 0, len(_WS_SCALES) - 1, idx)
+    return _WS_SCALES[idx]
+
+
+def get_uvg_by_3h(data, intervals_utc):
     """
     计算风速，用inner的计算方法
     小时最大阵风转化为等级
     """
-    def ws2scale_city(ws):
-        undef=32767
-        if np.abs(ws)!=undef:
-            if 0<=ws<5.0:
-                scale=2
-            elif 5.0<=ws<8.0:
-                scale=4
-            elif 8.0<=ws<10:
-                scale=5
-            elif 10<=ws<12:
-                scale=6
-            elif 12<=ws<14:
-                scale=6.5
-            elif 14<=ws<16:
-                scale=7
-            elif 16<=ws<18:
-                scale=7.5
-            elif 18<=ws<20:
-                scale=8
-            elif 20<=ws<22:
-                scale=8.5
-            elif 22<=ws<26:
-                scale=9
-            elif 26<=ws<27.5:
-                scale=9.5
-            elif 27.5<=ws<28.5:
-                scale=10
-            elif 28.5<=ws<30:
-                scale=10.5
-            elif 29.5<=ws<31.5:
-                scale=11
-            elif 31.5<=ws<33.5:
-                scale=11.5
-            elif 33.5<=ws<35.5:
-                scale=12
-            elif 35.5<=ws<37.5:
-                scale=12.5
-            elif 37.5<=ws<39.5:
-                scale=13
-            elif 39.5<=ws<41.5:
-                scale=13.5
-            elif 41.5<=ws<43.9:
-                scale=14
-            elif 43.9<=ws<46.2:
-                scale=14.5
-            elif 46.2<=ws<48.7:
-                scale=15
-            elif 48.7<=ws<51.0:
-                scale=15.5
-            elif 51.0<=ws<53.6:
-                scale=16
-            elif 53.6<=ws<56.1:
-                scale=16.5
-            elif 56.1<=ws<58.7:
-                scale=17
-            elif 58.7<=ws<61.3:
-                scale=17.5
-            else:
-                scale=np.nan
-        return scale
+    bin_edges = bin_edges_by_3h(data['time'], intervals_utc)
+
+    # 各时段内的最大阵风
+    max_wind_speed = reduce_by_3h(data['i10fg'], bin_edges, np.nanmax)
+    uvg_list = ws2scale_city(max_wind_speed).tolist()
 
-    wndg = get_era5_data_by_vars(grib_file, "i10fg")
-    if wndg is None:
-        print("无法获取风速数据，请检查文件路径或变量名。")
-        return None
-    
-    wndg_da = wndg["i10fg"]
-    
-    intervals = generate_three_hour_intervals(time_str, format_str=format_str)
-    uvg_list = []
-    for interval_start, interval_end in intervals:
-        start_utc = beijing_to_utc(interval_start).replace(tzinfo=None)
-        end_utc = beijing_to_utc(interval_end).replace(tzinfo=None)
-        wndg_slice = wndg_da.sel(time=slice(start_utc, end_utc)).sel(latitude=lat_range, longitude=lon_range)
-        if wndg_slice.size == 0:
-            uvg_list.append(None)
-            continue
-        max_wind_speed = wndg_slice.max().item()
-        uvg_inner = ws2scale_city(max_wind_speed)
-        uvg_list.append(uvg_inner)
-    
     return uvg_list
 
 
-def get_cloud_by_3h(land_file, level_file, time_str, lat_range, lon_range, format_str = "%Y-%m-%dT%H:%M:%S"):
+def get_cloud_by_3h(data, intervals_utc):
     """
     计算云量代码
     需要tcc和lcc（总云量、低云量），rh850和rh700（850/700hPa相对湿度），tp（降水）
     返回云量代码cloud: 0, 1, 2
     """
+    levels = data.get('isobaricInhPa')
+    if levels is None or 850 not in levels or 700 not in levels:
+        print("湿度数据缺少isobaricInhPa维度")
+        return None
+    idx850 = int(np.flatnonzero(levels == 850)[0])
+    idx700 = int(np.flatnonzero(levels == 700)[0])
+
+    # 订正只与格点本身有关，先对整个时段一次性订正，只修改满足条件的元素，再按时段求平均
+    rh850 = data['r'][:, idx850] * 100
+    rh700 = data['r'][:, idx700] * 100
+    tcc = data['tcc'] * 100
+    lcc = data['lcc'] * 100
+    # 条件一
+    cond1 = (rh850 + rh700 < 140) & (rh850 < 80) & (rh700 < 80)
+    tcc[cond1] *= ((rh700[cond1] + rh850[cond1]) / 200) ** 0.4
+    # 条件二
+    cond2 = ((rh850 < 40) & (rh700 < 30)) | (rh700 < 10)
+    lcc[cond2] *= (rh850[cond2] / 100) ** 0.3
+    # 条件三（tp 已换算为 mm，阈值与原先按 m 比较的 0.3 相同）
+    lcc[data['tp'] < 300] /= 2
 
-    tcc_ds = get_era5_data_by_vars(land_file, "tcc")
-    lcc_ds = get_era5_data_by_vars(land_file, "lcc")
-    tp_ds = get_era5_data_by_vars(land_file, "tp")
-    rh_ds = get_era5_data_by_vars(level_file, "r")
-    
-    if tcc_ds is None or lcc_ds is None or rh_ds is None or tp_ds is None:
-            print("无法获取云量或湿度数据，请检查文件路径或变量名。")
-            return None
-    
     cloud_list = []
-    intervals = generate_three_hour_intervals(time_str, format_str=format_str)
-    for start_time_bjt, end_time_bjt in intervals:
-        start_time_utc = beijing_to_utc(start_time_bjt).replace(tzinfo=None)
-        end_time_utc = beijing_to_utc(end_time_bjt).replace(tzinfo=None)
-        tcc = tcc_ds["tcc"].sel(time=slice(start_time_utc, end_time_utc)).sel(latitude=lat_range, longitude=lon_range)
-        lcc = lcc_ds["lcc"].sel(time=slice(start_time_utc, end_time_utc)).sel(latitude=lat_range, longitude=lon_range)
-        tp = tp_ds["tp"].sel(time=slice(start_time_utc, end_time_utc)).sel(latitude=lat_range, longitude=lon_range)
-        if "isobaricInhPa" in rh_ds["r"].dims:
-            rh850 = rh_ds["r"].sel(time=slice(start_time_utc, end_time_utc), isobaricInhPa=850).sel(latitude=lat_range, longitude=lon_range)
-            rh700 = rh_ds["r"].sel(time=slice(start_time_utc, end_time_utc), isobaricInhPa=700).sel(latitude=lat_range, longitude=lon_range)
-        else:
-            print("湿度数据缺少isobaricInhPa维度")
-            return None
-        
-        rh850 = rh850 * 100
-        rh700 = rh700 * 100
-        tcc = tcc * 100
-        lcc = lcc * 100
-        # 条件一
-        cond1 = (rh850 + rh700 < 140) & (rh850 < 80) & (rh700 < 80)
-        tcc = tcc.where(~cond1, tcc * ((rh700 + rh850) / 200) ** 0.4)
-        # 条件二
-        cond2 = ((rh850 < 40) & (rh700 < 30)) | (rh700 < 10)
-        lcc = lcc.where(~cond2, lcc * (rh850 / 100) ** 0.3)
-        # 条件三
-        tp_aligned = tp.reindex_like(lcc)
-        cond3 = (tp_aligned < 0.3)
-        lcc = lcc.where(~cond3, lcc / 2)
-
-        meanlcc = np.nanmean(lcc)
-        meantcc = np.nanmean(tcc)
+    bin_edges = bin_edges_by_3h(data['time'], intervals_utc)
+    for start, end in zip(bin_edges[:-1], bin_edges[1:]):
+        meanlcc = np.nanmean(lcc[start:end])
+        meantcc = np.nanmean(tcc[start:end])
 
         if ((meantcc > 80) and (meanlcc > 40)) or (meantcc > 90) or (meanlcc > 90):
             cloud = 2
@@ -349,69 +340,123 @@ def get_cloud_by_3h(land_file, level_file, time_str, lat_range, lon_range, forma
     return cloud_list
 
 
-def get_rain_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%m-%dT%H:%M:%S"):
-    start_time_bjt = datetime.strptime(time_str, format_str)
-    end_time_bjt = start_time_bjt + timedelta(days=1)
-    end_time_bjt = end_time_bjt.replace(hour=20, minute=0, second=0, microsecond=0)
-
-    intervals = []
-    t = start_time_bjt
-    while t < end_time_bjt:
-        interval_start = t
-        interval_end = t + timedelta(hours=3)
-        if interval_end > end_time_bjt:
-            interval_end = end_time_bjt
-        intervals.append((interval_start, interval_end))
-        t = interval_end
-
-    tp_ds = get_era5_data_by_vars(grib_file, "tp")
-    sf_ds = get_era5_data_by_vars(grib_file, "sf")
-    cp_ds = get_era5_data_by_vars(grib_file, "cp")
-    if tp_ds is None or sf_ds is None or cp_ds is None:
-        print("无法获取降水相关数据，请检查文件路径或变量名。")
-        return None, None, None
-
-    tp_da = tp_ds["tp"] * 1000  # 转化为mm
-    sf_da = sf_ds["sf"] * 1000
-    cp_da = cp_ds["cp"] * 1000
+@njit(parallel=True, cache=True)
+def _rain_counts(tp, sf, cp, bin_edges, thresholds):
+    """
+    一次遍历统计各 3 小时时段内的降水格点数和极值。
 
-    ifrain_list, tpmax_list, rain_percent_list = [], [], []
-    for interval_start, interval_end in intervals:
-        start_utc = beijing_to_utc(interval_start).replace(tzinfo=None)
-        end_utc = beijing_to_utc(interval_end).replace(tzinfo=None)
+    参数:
+    tp, sf, cp (numpy.ndarray): 形状为 (时间, 格点) 的总降水、降雪、对流降水(mm)，float32。
+    bin_edges (numpy.ndarray): 长度为时段数+1 的时间下标边界，第 b 个时段为 [bin_edges[b], bin_edges[b+1])。
+    thresholds (numpy.ndarray): 各时段的降水阈值(mm)，低于阈值的 tp 视为无降水。
 
-        tp = tp_da.sel(time=slice(start_utc, end_utc)).sel(latitude=lat_range, longitude=lon_range)
-        sf = sf_da.sel(time=slice(start_utc, end_utc)).sel(latitude=lat_range, longitude=lon_range)
-        
-        cp = cp_da.sel(time=slice(start_utc, end_utc)).sel(latitude=lat_range, longitude=lon_range)
-        tp = tp.reindex_like(sf)
-        cp = cp.reindex_like(sf)
+    返回:
+    counts (numpy.ndarray): (时段数, 7)，依次为 总格点、降水、雨夹雪、雪、雨、雷阵雨、阵雨 的格点数。
+    maxes (numpy.ndarray): (时段数, 4)，依次为 tp、雨、雪(sf)、雨夹雪 的最大值，没有对应格点时为 NaN。
+    """
+    n_bins = bin_edges.shape[0] - 1
+    n_points = tp.shape[1]
+    counts = np.zeros((n_bins, 7), dtype=np.int64)
+    maxes = np.full((n_bins, 4), np.nan)
+
+    # 各时段相互独立，按时段并行，避免多线程写同一行
+    for b in prange(n_bins):
+        threshold = thresholds[b]
+        for t in range(bin_edges[b], bin_edges[b + 1]):
+            for i in range(n_points):
+                counts[b, 0] += 1
+                p = tp[t, i]
+                # 低于阈值或缺测都不算降水（NaN 比较为 False）
+                if not p >= threshold:
+                    continue
+                s = sf[t, i]
+                c = cp[t, i]
+                diff = p - s
+
+                if not p <= maxes[b, 0]:
+                    maxes[b, 0] = p
+
+                if diff > _F32_01 and s > _F32_01:
+                    counts[b, 1] += 1
+                    counts[b, 2] += 1
+                    if not p <= maxes[b, 3]:
+                        maxes[b, 3] = p
+                elif diff < _F32_01 and s > _F32_01:
+                    counts[b, 1] += 1
+                    counts[b, 3] += 1
+                    if not s <= maxes[b, 2]:
+                        maxes[b, 2] = s
+                elif diff > _F32_01 and s < _F32_01:
+                    counts[b, 1] += 1
+                    counts[b, 4] += 1
+                    if not p <= maxes[b, 1]:
+                        maxes[b, 1] = p
+                    if c >= _F32_5:
+                        counts[b, 5] += 1
+                    elif c > _F32_2:
+                        counts[b, 6] += 1
+
+    return counts, maxes
+
+
+def _rain_counts_numpy(tp, sf, cp, bin_edges, thresholds):
+    """
+    _rain_counts 的 NumPy 版本，未安装 numba 时使用，参数和返回值相同。
+    每个时段只构造一次布尔掩码，用 count_nonzero 计数，不生成 NaN 填充的中间数组。
+    """
+    n_bins = bin_edges.shape[0] - 1
+    counts = np.zeros((n_bins, 7), dtype=np.int64)
+    maxes = np.full((n_bins, 4), np.nan)
+
+    for b in range(n_bins):
+        p = tp[bin_edges[b]:bin_edges[b + 1]]
+        s = sf[bin_edges[b]:bin_edges[b + 1]]
+        c = cp[bin_edges[b]:bin_edges[b + 1]]
+
+        # 低于阈值或缺测都不算降水（NaN 比较为 False）
+        precip = p >= thresholds[b]
+        diff = p - s
+        sleet = precip & (diff > _F32_01) & (s > _F32_01)
+        snow = precip & (diff < _F32_01) & (s > _F32_01)
+        rain = precip & (diff > _F32_01) & (s < _F32_01)
+        n_sleet, n_snow, n_rain = (np.count_nonzero(sleet), np.count_nonzero(snow),
+                                   np.count_nonzero(rain))
+
+        counts[b] = (p.size, n_sleet + n_snow + n_rain, n_sleet, n_snow, n_rain,
+                     np.count_nonzero(rain & (c >= _F32_5)),
+                     np.count_nonzero(rain & (c > _F32_2) & (c < _F32_5)))
+        for k, (values, mask) in enumerate(((p, precip), (p, rain), (s, snow), (p, sleet))):
+            if mask.any():
+                maxes[b, k] = values[mask].max()
+
+    return counts, maxes
+
+
+def get_rain_by_3h(data, intervals_utc):
+    # 冬夏半年按北京时间的月份划分
+    months = [utc_to_beijing(start).month for start, _ in intervals_utc]
+
+    # 整理成 (时间, 格点) 的连续数组（已是 mm，连续的 float32 数据不会复制）
+    n_time = data['time'].shape[0]
+    tp_a = np.ascontiguousarray(data['tp'].reshape(n_time, -1), dtype=np.float32)
+    sf_a = np.ascontiguousarray(data['sf'].reshape(n_time, -1), dtype=np.float32)
+    cp_a = np.ascontiguousarray(data['cp'].reshape(n_time, -1), dtype=np.float32)
+
+    bin_edges = bin_edges_by_3h(data['time'], intervals_utc)
+    # 夏半年 (4-10月) 阈值 0.2mm，冬半年 0.15mm
+    thresholds = np.array([0.2 if mon in range(4, 11) else 0.15 for mon in months],
+                          dtype=np.float32)
+    rain_counts = _rain_counts if NUMBA_AVAILABLE else _rain_counts_numpy
+    counts, maxes = rain_counts(tp_a, sf_a, cp_a, bin_edges, thresholds)
 
-        mon = interval_start.month
-        if mon in range(4, 11):
-            tp = tp.where(tp >= 0.2)
-        else:
-            tp = tp.where(tp >= 0.15)
-
-        sleet = tp.where(((tp - sf) > 0.1) & (sf > 0.1))
-        snow = sf.where(((tp - sf) < 0.1) & (sf > 0.1))
-        print(np.sum(snow).item())
-        rain = tp.where(((tp - sf) > 0.1) & (sf < 0.1))
-        thunder = tp.where((~np.isnan(rain)) & (cp >= 5))
-        drizzle = tp.where((~np.isnan(rain)) & (cp > 2) & (cp < 5))
-
-        count_precip = np.sum((~np.isnan(rain)) | (~np.isnan(sleet)) | (~np.isnan(snow))).item()
-        count_total = tp.size # 或者使用 mask.size
-        count_sleet = np.sum(~np.isnan(sleet)).item()
-        count_snow = np.sum(~np.isnan(snow)).item()
-        count_rain = np.sum(~np.isnan(rain)).item()
-        count_thunder = np.sum(~np.isnan(thunder)).item()
-        count_drizzle = np.sum(~np.isnan(drizzle)).item()
-
-        if tp.size == 0 or np.all(np.isnan(tp)):
+    ifrain_list, tpmax_list, rain_percent_list = [], [], []
+    for b, mon in enumerate(months):
+        (count_total, count_precip, count_sleet, count_snow,
+         count_rain, count_thunder, count_drizzle) = counts[b].tolist()
+        tpmax, rain_max, snow_max, sleet_max = maxes[b].tolist()
+
+        if np.isnan(tpmax):
             tpmax = 0
-        else:
-            tpmax = np.nanmax(tp).item()
         tpmax_list.append(tpmax)
 
         rain_percent = count_precip / count_total if count_total > 0 else 0
@@ -451,7 +496,7 @@ def get_rain_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%
                     ifrain = 2.2
             elif rain_type[2] == 1: # 有雨 (非阵雨或雷阵雨)
                 if rain_percent >= 0.8:
-                    if np.nanmax(rain.data) >= 5:
+                    if rain_max >= 5:
                         ifrain = 1.0
                     else:
                         ifrain = 1.1
@@ -487,7 +532,7 @@ def get_rain_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%
                             ifrain = 15.2
                 else: # 只有雪，没有阵雨、雨夹雪、雨
                     if rain_percent >= 0.8:
-                        if np.nanmax(snow.data) >= 0.5:
+                        if snow_max >= 0.5:
                             ifrain = 12.0
                         else:
                             ifrain = 12.1
@@ -523,25 +568,25 @@ def get_rain_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%
                     if rain_type[2] == 1 and rain_type[0] == 1:
                         if count_rain >= count_sleet:
                             if rain_percent >= 0.8: 
-                                if np.nanmax(rain.data) >= 5: ifrain = 4.0
+                                if rain_max >= 5: ifrain = 4.0
                                 else: ifrain = 4.1
                             elif 0.5 <= rain_percent < 0.8: ifrain = 4.2
                             else: ifrain = 4.4
                         else:
                             if rain_percent >= 0.8: 
-                                if np.nanmax(rain.data) >= 5: ifrain = 8.0
+                                if rain_max >= 5: ifrain = 8.0
                                 else: ifrain = 8.1
                             elif 0.5 <= rain_percent < 0.8: ifrain = 8.2
                             else: ifrain = 8.4
                     elif rain_type[0] == 1: # 只有雨夹雪
                         if rain_percent >= 0.8: 
-                            if np.nanmax(sleet.data) >= 3: ifrain = 6.0
+                            if sleet_max >= 3: ifrain = 6.0
                             else: ifrain = 6.1
                         elif 0.5 <= rain_percent < 0.8: ifrain = 6.2
                         else: ifrain = 6.4
                     elif rain_type[2] == 1: # 只有雨
                         if rain_percent >= 0.8: 
-                            if np.nanmax(rain.data) >= 5: ifrain = 1.0
+                            if rain_max >= 5: ifrain = 1.0
                             else: ifrain = 1.1
                         elif 0.5 <= rain_percent < 0.8: ifrain = 1.2
                         else: ifrain = 1.4
@@ -551,6 +596,35 @@ def get_rain_by_3h(grib_file, time_str, lat_range, lon_range, format_str = "%Y-%
     return ifrain_list, tpmax_list, rain_percent_list
 
 
+def _csv_column(values):
+    """
+    按 pandas 的类型推断整理一列：数值列中只要有浮点数，整数也按浮点数输出（0 -> 0.0），
+    NaN 输出为空字段。
+    """
+    is_float = [isinstance(v, (float, np.floating)) for v in values]
+    if any(is_float) and all(f or isinstance(v, (int, np.integer)) for f, v in zip(is_float, values)):
+        return ['' if f and np.isnan(v) else (v if f else float(v)) for f, v in zip(is_float, values)]
+    return values
+
+
+def write_csv(save_path, columns):
+    """
+    按列写出 CSV，不经过 pandas，输出与 DataFrame.to_csv(index=False) 一致。
+
+    参数:
+    save_path (str): 输出文件路径。
+    columns (dict): 列名 -> 等长的值列表，按插入顺序输出。
+                    与 DataFrame 一样，标量（如提取失败时的 None）广播为整列，None 输出为空字段。
+    """
+    n_rows = max((len(v) for v in columns.values() if isinstance(v, (list, tuple, np.ndarray))), default=1)
+    columns = {name: values if isinstance(values, (list, tuple, np.ndarray)) else [values] * n_rows
+               for name, values in columns.items()}
+    with open(save_path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns.keys())
+        writer.writerows(zip(*(_csv_column(values) for values in columns.values())))
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="处理 ERA5 GRIB 数据并生成天气预报 CSV")
     
@@ -576,9 +650,27 @@ if __name__ == '__main__':
     start_date = datetime.strptime(args.start_date, "%Y-%m-%d")
     end_date = datetime.strptime(args.end_date, "%Y-%m-%d")
     hours_to_run = [5, 11, 17, 20]
-    
+
+    DEFAULT_LON_SLICE = 121.4317
+    DEFAULT_LAT_SLICE = 31.1922
+    DEFAULT_TARGET_LAT = slice(32, 30.5)
+    DEFAULT_TARGET_LON = slice(120.5, 122)
+
     current_date = start_date
     print(f"--- 开始处理数据: {args.start_date} 至 {args.end_date} ---")
+
+    # 相邻时次的预报时段大量重叠，一次性读取整个日期范围 × 区域的数据，
+    # 每个时次只在内存中按时间切片，避免同一时刻的数据被反复解码
+    range_start_utc = prepare_intervals(start_date.replace(hour=hours_to_run[0]).strftime("%Y-%m-%dT%H:%M:%S"))[0][0]
+    range_end_utc = prepare_intervals(end_date.replace(hour=hours_to_run[-1]).strftime("%Y-%m-%dT%H:%M:%S"))[-1][1]
+    range_data = preload_window(
+        {args.land_file: LAND_VARS, args.level_file: LEVEL_VARS},
+        range_start_utc, range_end_utc,
+        DEFAULT_TARGET_LAT, DEFAULT_TARGET_LON)
+    if range_data is None:
+        print("❌ 错误: 数据提取失败，请检查输入文件中的变量。")
+        sys.exit(1)
+    convert_units(range_data)
     
     while current_date <= end_date:
         for hour in hours_to_run:
@@ -586,26 +678,26 @@ if __name__ == '__main__':
 
             print(f"正在处理: {start_time} ...", end="", flush=True)
 
-            time_intervals_bjt = [i[0] for i in generate_three_hour_intervals(start_time)]
+            time_intervals = generate_three_hour_intervals(start_time)
+            time_intervals_bjt = [i[0] for i in time_intervals]
+            # 时段的 UTC 边界只算一次，所有计算函数共用
+            intervals_utc = prepare_intervals(start_time)
+
+            window_data = slice_window(range_data, intervals_utc[0][0], intervals_utc[-1][1])
 
-            DEFAULT_LON_SLICE = 121.4317
-            DEFAULT_LAT_SLICE = 31.1922
-            DEFAULT_TARGET_LAT = slice(32, 30.5)
-            DEFAULT_TARGET_LON = slice(120.5, 122)
-            
             # 提取数据
-            max_temps_c, min_temps_c = get_temperature_by_3h(args.land_file, start_time, DEFAULT_LAT_SLICE, DEFAULT_LON_SLICE)
-            rh_min, rh_max = get_rh_by_days(args.land_file, start_time, DEFAULT_TARGET_LAT, DEFAULT_TARGET_LON)
-            wdir_list = get_wdir_by_3h(args.land_file, start_time, DEFAULT_LAT_SLICE, DEFAULT_LON_SLICE)
-            uvg_list = get_uvg_by_3h(args.land_file, start_time, DEFAULT_LAT_SLICE, DEFAULT_LON_SLICE)
-            cloud_list = get_cloud_by_3h(args.land_file, args.level_file, start_time, DEFAULT_LAT_SLICE, DEFAULT_LON_SLICE)
-            ifrain_list, tpmax_list, rain_percent_list = get_rain_by_3h(args.land_file, start_time, DEFAULT_LAT_SLICE, DEFAULT_LON_SLICE)
+            max_temps_c, min_temps_c = get_temperature_by_3h(window_data, intervals_utc)
+            rh_min, rh_max = get_rh_by_days(window_data, DEFAULT_LAT_SLICE, DEFAULT_LON_SLICE)
+            wdir_list = get_wdir_by_3h(window_data, intervals_utc)
+            uvg_list = get_uvg_by_3h(window_data, intervals_utc)
+            cloud_list = get_cloud_by_3h(window_data, intervals_utc)
+            ifrain_list, tpmax_list, rain_percent_list = get_rain_by_3h(window_data, intervals_utc)
 
             if not ifrain_list:
                 print(" [失败] 数据提取不完整")
                 continue
 
-            data = pd.DataFrame({
+            columns = {
                 'fsttime': time_intervals_bjt,
                 'max_temp_c': max_temps_c,
                 'min_temp_c': min_temps_c,
@@ -617,12 +709,11 @@ if __name__ == '__main__':
                 'ifrain': ifrain_list,
                 'tpmax': tpmax_list,
                 'rain_percent': rain_percent_list
-            })
-
+            }
 
             file_name = f"{start_time.replace(':', '').replace('T', '_')}.csv"
             save_path = os.path.join(args.output_dir, file_name)
-            data.to_csv(save_path, index=False)
+            write_csv(save_path, columns)
             print(f" -> {file_name}")
 
         current_date += timedelta(days=1)
@@ -1,22 +1,46 @@
 from datetime import date, datetime, timedelta
+import asyncio
+import hashlib
 import os
 import json
 import argparse
-import sys
-from typing import Dict, Any, List
-import pandas as pd
-import tqdm
-from langchain_openai import ChatOpenAI
+import multiprocessing
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import urlparse
+from tqdm.asyncio import tqdm_asyncio
 from dotenv import load_dotenv
 
+# httpx、openai、langchain_openai 导入耗时在秒级，只在真正用到时导入，
+# 使 --help 和参数校验出错时能立即返回
+
 # ========== 配置环境变量 ==========
 load_dotenv() 
 
 # 预先检查环境变量
 api_key = os.getenv("CHAT_API_KEY") 
-base_url = os.getenv("CHAT_API_BASE_URL")
+# 空字符串按未设置处理，交给 openai 客户端使用默认的官方地址
+base_url = os.getenv("CHAT_API_BASE_URL") or None
 model_name = os.getenv("CHAT_MODEL", "Qwen3-32B")
 
+# 限流配置：并发数、每分钟请求数、每分钟 token 数（0 表示不限制）
+# 并发数保持字符串，作为 --max_concurrency 的默认值同样经过 positive_int 校验
+max_async = os.getenv("LLM_MAX_ASYNC", "8")
+requests_per_minute = int(os.getenv("LLM_RPM", "0"))
+tokens_per_minute = int(os.getenv("LLM_TPM", "0"))
+
+MAX_TOKENS = 8192
+STOP = ["<|im_end|>"]
+# 模型输出中第一个 </think> 之前为思考过程，之后为报告；开头的 <think> 可省略
+_THINK_RE = re.compile(r'^\s*(?:<think>)?(.*?)</think>\s*(.*)$', re.DOTALL)
+# 输出目录中记录已完成时次的清单文件，每完成一个时次追加一行
+MANIFEST_NAME = "_manifest.jsonl"
+# OpenAI 按该键路由请求，使共享前缀稳定命中同一份 Prompt 缓存
+PROMPT_CACHE_KEY = "weather-forecast-v1"
+
 if not api_key:
     raise ValueError("错误: 未在 .env 文件中找到 CHAT_API_KEY")
 
@@ -28,13 +52,13 @@ def parse_arguments():
     
     parser.add_argument(
         "--start_date", 
-        type=str, 
+        type=validate_date, 
         default="2021-01-01", 
         help="开始日期，格式 YYYY-MM-DD (默认: 2021-01-01)"
     )
     parser.add_argument(
         "--end_date", 
-        type=str, 
+        type=validate_date, 
         default="2021-01-03", 
         help="结束日期，格式 YYYY-MM-DD (默认: 2021-01-03)"
     )
@@ -50,75 +74,532 @@ def parse_arguments():
         default="./report_by_llm", 
         help="生成的报告保存路径"
     )
+    parser.add_argument(
+        "--max_concurrency", 
+        type=positive_int, 
+        default=max_async, 
+        help="同时进行的大模型请求数上限 (默认: 环境变量 LLM_MAX_ASYNC 或 8)"
+    )
+    parser.add_argument(
+        "--cache_dir", 
+        type=str, 
+        default="./.llm_cache", 
+        help="大模型响应缓存目录，相同输入直接复用结果；传空字符串关闭缓存 (默认: ./.llm_cache)"
+    )
+    parser.add_argument(
+        "--overwrite", 
+        action="store_true", 
+        help="重新生成所有时次（默认跳过清单中输入未变且报告仍在的时次；输入未变的时次仍会命中 --cache_dir 缓存）"
+    )
+    parser.add_argument(
+        "--endpoints", 
+        type=str, 
+        default=None, 
+        help="逗号分隔的多个模型服务地址（如多个 vLLM 副本），时次按地址数分片到多个进程并行生成；"
+             "每个进程各自使用 --max_concurrency 和限流额度 (默认: 只使用 CHAT_API_BASE_URL)"
+    )
+    parser.add_argument(
+        "--batch", 
+        action="store_true", 
+        help="使用 OpenAI Batch API 离线批量生成（仅 OpenAI 官方接口，其他接口自动改为并发调用）"
+    )
+    parser.add_argument(
+        "--batch_poll_interval", 
+        type=int, 
+        default=60, 
+        help="Batch 任务状态的轮询间隔秒数 (默认: 60)"
+    )
     
     return parser.parse_args()
 
 def validate_date(date_str):
     """
-    验证并转换日期字符串
+    验证并转换日期字符串，作为 argparse 的 type 使用，格式错误时由 argparse 报错退出
     """
     try:
         return datetime.strptime(date_str, "%Y-%m-%d").date()
     except ValueError:
-        print(f"❌ 错误: 日期格式 '{date_str}' 无效，请使用 YYYY-MM-DD 格式")
-        sys.exit(1)
+        raise argparse.ArgumentTypeError(f"日期格式 '{date_str}' 无效，请使用 YYYY-MM-DD 格式")
+
+def positive_int(value):
+    """
+    校验正整数参数，作为 argparse 的 type 使用；并发数为 0 时所有请求都会永远等待
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' 不是整数")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"必须为正整数，当前为 {number}")
+    return number
 
 def generate_timestamps(start_date: date, end_date: date):
     """
     生成时间戳列表，格式: YYYY-MM-DD_HHMMSS
     """
     current_date = start_date
-    date_format = "%Y-%m-%d"
-    time_format = "%H%M%S"
     hours = [5, 11, 17, 20]
     formatted_timestamps = []
 
+    # 每天只格式化一次日期，时分秒直接拼接
     while current_date <= end_date:
-        for hour in hours:
-            dt_object = datetime(current_date.year, current_date.month, current_date.day, hour)
-            date_str = dt_object.strftime(date_format)
-            time_str = dt_object.strftime(time_format)
-            formatted_timestamps.append(f"{date_str}_{time_str}")
+        day_str = current_date.strftime("%Y-%m-%d")
+        formatted_timestamps.extend(f"{day_str}_{hour:02d}0000" for hour in hours)
         current_date += timedelta(days=1)
-
     return formatted_timestamps
 
 def extract_think_and_content(text: str) -> List[str]:
     """
     解析模型输出，分离思考过程(<think>)和最终结果。
     """
-    if '<think>' in text and '</think>' in text:
-        parts = text.split('</think>', 1)
-        think_part = parts[0].replace('<think>', '').strip()
-        report_part = parts[1].strip()
-        return [think_part, report_part]
-    elif '</think>' in text:
-        parts = text.split('</think>', 1)
-        return [parts[0].strip(), parts[1].strip()]
-    else:
+    m = _THINK_RE.match(text)
+    if not m:
         return ["", text.strip()]
+    think_part = m.group(1)
+    # 极少数情况下 <think> 不在开头，与原先一样全部去掉
+    if '<think>' in think_part:
+        think_part = think_part.replace('<think>', '')
+    return [think_part.strip(), m.group(2).strip()]
+
+class TokenBucket:
+    """
+    按每分钟请求数 (RPM) 和每分钟 token 数 (TPM) 主动限流的令牌桶。
+    额度按时间匀速补充，桶容量为一分钟的额度；额度为 0 表示不限制。
+    """
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.available_requests = min(self.requests_per_minute,
+                                      self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute,
+                                    self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, n_tokens):
+        """等待直到额度足够发出一个约 n_tokens 的请求，并扣除额度"""
+        # 单个请求超过桶容量时按满额计算，否则永远等不到
+        n_tokens = min(n_tokens, self.tokens_per_minute)
+        # 持锁等待，先到的请求先获得额度
+        async with self.lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self.available_requests < 1:
+                    wait = (1 - self.available_requests) * 60 / self.requests_per_minute
+                if self.tokens_per_minute and self.available_tokens < n_tokens:
+                    wait = max(wait, (n_tokens - self.available_tokens) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self.available_requests -= 1
+            if self.tokens_per_minute:
+                self.available_tokens -= n_tokens
+
+def split_prompt(prompt_template):
+    """
+    启动时以 <!INPUT!> 为界拆分一次 Prompt 模板：之前的固定部分作为 system 消息，之后的部分接在 CSV 数据后作为 user 消息。
+    system 消息在所有请求间逐字节相同，服务端（OpenAI Prompt 缓存、vLLM/SGLang 前缀缓存）只需预填充一次。
 
-def get_single_response(chat_model, user_prompt, max_retries=2):
+    返回:
+    tuple: (system 消息 dict, 后缀字符串)。
+    """
+    prefix, _, suffix = prompt_template.partition('<!INPUT!>')
+    return {"role": "system", "content": prefix}, suffix
+
+def build_messages(prompt, raw_csv_content):
+    """用 split_prompt 的结果组装单次请求的消息，system 消息直接复用同一个 dict"""
+    system_message, suffix = prompt
+    return [system_message, {"role": "user", "content": raw_csv_content + suffix}]
+
+async def get_single_response(chat_model, messages, bucket, max_retries=3):
     """
     调用大模型并处理重试逻辑
     """
-    for attempt in range(max_retries + 1):
+    from openai import APIConnectionError, APITimeoutError, RateLimitError
+    from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+    # 粗略估计 token 数：输入约 4 个字符一个 token，加上输出上限
+    n_tokens = sum(len(m["content"]) for m in messages) // 4 + MAX_TOKENS
+    # 只重试限流、连接失败、超时等暂时性错误，鉴权、参数错误等直接失败；
+    # 随机指数退避避免所有请求同时重试
+    retrying = AsyncRetrying(
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError)),
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(max_retries + 1),
+        before_sleep=lambda state: print(f"  [Attempt {state.attempt_number}] 暂时性错误，稍后重试: {state.outcome.exception()}"),
+        reraise=True,
+    )
+    try:
+        async for attempt in retrying:
+            with attempt:
+                await bucket.acquire(n_tokens)
+                # 流式接收：边生成边读取，长思考过程不必等整个响应体返回；思考过程也要保存，因此不提前中断
+                parts = []
+                async for chunk in chat_model.astream(messages):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                content = ''.join(parts)
+    except Exception as e:
+        print(f"  API 调用失败: {e}")
+        return ["", ""]
+
+    return extract_think_and_content(content)
+
+def _is_openai_endpoint(url):
+    """未设置 base_url 或指向 api.openai.com 时视为 OpenAI 官方接口"""
+    return not url or urlparse(url).hostname == "api.openai.com"
+
+def make_http_client():
+    """
+    所有请求共用的 HTTP 客户端：长连接复用 TCP/TLS 会话，并启用 HTTP/2 多路复用，
+    避免每个时次都重新握手。
+    """
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        timeout=120,
+    )
+
+def list_files(directory):
+    """
+    一次 os.scandir 列出目录下的全部文件名，之后用集合判断文件是否存在，
+    代替逐个时次调用 os.path.exists。目录不存在时返回空集合。
+    """
+    try:
+        with os.scandir(directory) as it:
+            return {entry.name for entry in it if entry.is_file()}
+    except FileNotFoundError:
+        return set()
+
+def existing_reports(report_dir, wanted):
+    """
+    输出目录中已有非空报告的时次集合，只考虑 wanted 中的时次。
+    先按文件名做集合判断，只对请求范围内的报告调用 stat 检查大小。
+    """
+    done = set()
+    if not wanted:
+        return done
+    with os.scandir(report_dir) as it:
+        for entry in it:
+            if not entry.name.endswith('.txt'):
+                continue
+            day_str = entry.name[:-len('.txt')]
+            if day_str in wanted and entry.is_file() and entry.stat().st_size > 0:
+                done.add(day_str)
+    return done
+
+def load_manifest(report_dir):
+    """
+    读取清单中已完成的时次及生成时请求的缓存键，同一时次以最后一条为准。
+    中断时可能留下不完整的最后一行，跳过即可。
+
+    返回:
+    dict: {时次: 缓存键}，旧清单中没有 key 的记录为 None。
+    """
+    done = {}
+    try:
+        with open(os.path.join(report_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    done[entry["id"]] = entry.get("key")
+                except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return done
+
+def record_done(manifest, day_str, key):
+    """报告写出后向清单追加一行并立即刷新，进程中途退出也不会丢失已完成的记录"""
+    manifest.write(json.dumps({"id": day_str, "ts": time.time(), "key": key}) + "\n")
+    manifest.flush()
+
+def load_csvs(datelist, csv_dir):
+    """
+    在调用大模型之前用线程池一次性读入所有 CSV，使磁盘 I/O 相互重叠，也不再与网络请求交错。
+    缺失或为空的文件在此处跳过，不会占用任何请求。
+
+    返回:
+    dict: {时次: CSV 内容}，只包含有内容的时次，顺序与 datelist 一致。
+    """
+    available = list_files(csv_dir)
+    present = []
+    for day_str in datelist:
+        if f'{day_str}.csv' in available:
+            present.append(day_str)
+        else:
+            print(f"  ⚠️ 警告: {os.path.join(csv_dir, f'{day_str}.csv')} 不存在")
+
+    def _read(day_str):
         try:
-            response = chat_model.invoke([{"role": "user", "content": user_prompt}])
-            content = response.content
-            if content:
-                return extract_think_and_content(content)
+            return read_text(os.path.join(csv_dir, f'{day_str}.csv'))
         except Exception as e:
-            print(f"  [Attempt {attempt+1}] API 调用失败: {e}")
-            if attempt == max_retries:
-                return ["", ""]
-    return ["", ""]
+            print(f"❌ {day_str} 读取 CSV 发生异常: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        contents = pool.map(_read, present)
+        return {day_str: content for day_str, content in zip(present, contents) if content}
+
+def _make_chat_model(http_client, endpoint):
+    """创建所有请求共用的 ChatOpenAI 客户端，endpoint 为 None 时使用 OpenAI 官方地址"""
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model_name, 
+        openai_api_key=api_key,
+        openai_api_base=endpoint,
+        temperature=0,
+        max_tokens=MAX_TOKENS,
+        stop=STOP,
+        # 单个请求卡住最多 90 秒；重试统一由 get_single_response 中的 tenacity 负责，客户端自身不再重试
+        request_timeout=90,
+        max_retries=0,
+        stream_usage=False,
+        http_async_client=http_client,
+        # prompt_cache_key 只有 OpenAI 官方接口支持，其他兼容接口可能拒绝未知参数
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY} if _is_openai_endpoint(endpoint) else None
+    )
+
+def _batch_results(text):
+    """逐行解析 Batch API 的结果文件"""
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def _batch_error(result):
+    """取出 Batch 单条结果的错误信息：请求级 error，或响应体中的 error，或状态码"""
+    response = result.get("response") or {}
+    body = response.get("body") or {}
+    return result.get("error") or body.get("error") or response.get("status_code")
+
+async def run_batch(csvs, prompt, report_dir, poll_interval, http_client, manifest, endpoint, cache_dir=None):
+    """
+    通过 OpenAI Batch API 一次性提交所有时次：上传一个 JSONL 请求文件，轮询直到任务结束，
+    再按 custom_id 拆分结果写出报告。给定 cache_dir 时，已缓存的时次直接写出，不再提交。
+
+    返回:
+    int: 成功生成的报告数。
+    """
+    success_count = 0
+    keys = {}
+    lines = []
+    for day_str, raw_csv_content in csvs.items():
+        messages = build_messages(prompt, raw_csv_content)
+        key = cache_key(messages)
+        cached = load_cached(cache_dir, key) if cache_dir else None
+        if cached is not None and cached[1]:
+            write_report(report_dir, day_str, *cached)
+            record_done(manifest, day_str, key)
+            success_count += 1
+            continue
+
+        keys[day_str] = key
+        lines.append(json.dumps({
+            "custom_id": day_str,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model_name,
+                "messages": messages,
+                "temperature": 0,
+                "max_tokens": MAX_TOKENS,
+                "stop": STOP,
+                "prompt_cache_key": PROMPT_CACHE_KEY,
+            },
+        }, ensure_ascii=False))
+
+    if success_count:
+        print(f"💾 {success_count} 个时次命中缓存，不再提交")
+    if not lines:
+        return success_count
+
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(api_key=api_key, base_url=endpoint, http_client=http_client)
+    batch_file = await client.files.create(
+        file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    print(f"📦 已提交 Batch 任务 {batch.id}，共 {len(lines)} 个请求")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        print(f"  Batch 状态: {batch.status}")
+
+    if batch.status != "completed":
+        print(f"❌ Batch 任务未完成: {batch.status}")
+        return success_count
+
+    # 失败的请求写在单独的 error 文件中，逐个报告
+    if batch.error_file_id:
+        errors = await client.files.content(batch.error_file_id)
+        for result in _batch_results(errors.text):
+            print(f"  ⚠️ 警告: {result['custom_id']} 请求失败: {_batch_error(result)}")
+
+    if not batch.output_file_id:
+        return success_count
+
+    output = await client.files.content(batch.output_file_id)
+    for result in _batch_results(output.text):
+        day_str = result["custom_id"]
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            print(f"  ⚠️ 警告: {day_str} 请求失败: {_batch_error(result)}")
+            continue
+
+        content = response["body"]["choices"][0]["message"]["content"]
+        [llm_think, final_report] = extract_think_and_content(content or "")
+        if not final_report:
+            print(f"  ⚠️ 警告: {day_str} 生成内容为空")
+            continue
+
+        if cache_dir:
+            save_cached(cache_dir, keys[day_str], llm_think, final_report)
+        write_report(report_dir, day_str, llm_think, final_report)
+        record_done(manifest, day_str, keys[day_str])
+        success_count += 1
+
+    return success_count
+
+def read_text(path):
+    # 以二进制一次读入再整体解码，省去文本模式的逐块解码和换行转换
+    with open(path, 'rb') as f:
+        content = f.read().decode('utf-8')
+    # generate_csv 写出的是 \n 换行；其他来源的 \r\n 仍按文本模式的规则统一
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+def _atomic_write(path, content):
+    """
+    先写同目录下的临时文件并落盘，再用 os.replace 原子替换目标文件。
+    中断时目标文件要么是旧内容要么是完整的新内容，不会留下半截文件。
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def cache_key(messages):
+    """由模型名、生成参数和完整消息计算缓存键，任一项变化都会得到新的键"""
+    payload = {"model": model_name, "temp": 0, "max_tokens": MAX_TOKENS, "stop": STOP, "messages": messages}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def load_cached(cache_dir, key):
+    """读取缓存的 [思考过程, 报告]，未命中时返回 None"""
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json"), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        return [cached["think"], cached["report"]]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+def write_report(report_dir, day_str, think, report):
+    # 报告最后写出：报告存在即表示该时次已完整生成
+    if think:
+        _atomic_write(os.path.join(report_dir, f"{day_str}_think.txt"), think)
+    _atomic_write(os.path.join(report_dir, f"{day_str}.txt"), report)
+
+def save_cached(cache_dir, key, think, report):
+    _atomic_write(os.path.join(cache_dir, f"{key}.json"),
+                  json.dumps({"think": think, "report": report}, ensure_ascii=False))
+
+async def process(day_str, raw_csv_content, chat_model, prompt, report_dir, semaphore, bucket, cache_dir=None, manifest=None):
+    """
+    处理单个时次：调用大模型、保存报告并记入清单。CSV 内容已由 load_csvs 预先读入。
+    文件读写放到线程中执行，不阻塞事件循环；semaphore 限制同时进行的请求数，bucket 限制请求速率。
+    给定 cache_dir 时，相同输入直接复用缓存的结果，不再调用大模型。
+
+    返回:
+    bool: 是否成功生成报告。
+    """
+    try:
+        messages = build_messages(prompt, raw_csv_content)
+        key = cache_key(messages)
+        cached = await asyncio.to_thread(load_cached, cache_dir, key) if cache_dir else None
+
+        if cached is not None:
+            [llm_think, final_report] = cached
+        else:
+            async with semaphore:
+                [llm_think, final_report] = await get_single_response(chat_model, messages, bucket)
+            if cache_dir and final_report:
+                await asyncio.to_thread(save_cached, cache_dir, key, llm_think, final_report)
+        
+        if not final_report:
+            print(f"  ⚠️ 警告: {day_str} 生成内容为空")
+            return False
+
+        # 保存结果：写盘放到线程中，不阻塞其他请求
+        await asyncio.to_thread(write_report, report_dir, day_str, llm_think, final_report)
+        if manifest is not None:
+            record_done(manifest, day_str, key)
+        
+        return True
+
+    except Exception as e:
+        print(f"❌ {day_str} 处理发生异常: {e}")
+        return False
+
+async def generate_reports(csvs, prompt, report_dir, args, endpoint):
+    """
+    使用 endpoint 指定的服务为 csvs 中的所有时次生成报告：--batch 且为 OpenAI 官方接口时走 Batch API，否则并发调用。
+
+    返回:
+    int: 成功生成的报告数。
+    """
+    http_client = make_http_client()
+    # 以追加模式打开，多个分片进程可同时写入同一份清单
+    manifest = open(os.path.join(report_dir, MANIFEST_NAME), 'a', encoding='utf-8')
+    try:
+        # 离线批量模式：整个任务一次提交给 Batch API
+        if args.batch:
+            if _is_openai_endpoint(endpoint):
+                try:
+                    return await run_batch(
+                        csvs, prompt, report_dir, args.batch_poll_interval, http_client, manifest, endpoint, args.cache_dir)
+                except Exception as e:
+                    print(f"❌ Batch 任务发生异常: {e}")
+                    return 0
+            print("⚠️ 警告: --batch 仅支持 OpenAI 官方接口，改为并发调用")
+
+        # 所有请求共用同一个连接池
+        chat_model = _make_chat_model(http_client, endpoint)
+
+        # 并发处理所有时次，同时进行的请求数不超过 max_concurrency，请求速率不超过 LLM_RPM / LLM_TPM
+        semaphore = asyncio.Semaphore(args.max_concurrency)
+        bucket = TokenBucket(requests_per_minute, tokens_per_minute)
+        results = await tqdm_asyncio.gather(
+            *[process(day_str, raw_csv_content, chat_model, prompt, report_dir, semaphore, bucket, args.cache_dir, manifest)
+              for day_str, raw_csv_content in csvs.items()])
+        return sum(results)
+    finally:
+        manifest.close()
+        await http_client.aclose()
+
+def _run_shard(endpoint, csvs, prompt, report_dir, args):
+    """子进程入口：在独立的事件循环中用指定的服务地址处理分到的时次"""
+    return asyncio.run(generate_reports(csvs, prompt, report_dir, args, endpoint))
 
 def main():
     # 1. 解析参数
     args = parse_arguments()
-    start_date = validate_date(args.start_date)
-    end_date = validate_date(args.end_date)
+    start_date = args.start_date
+    end_date = args.end_date
     csv_dir = args.csv_dir
     report_dir = args.output_dir
 
@@ -133,67 +614,51 @@ def main():
     
     # 2. 准备目录
     os.makedirs(report_dir, exist_ok=True)
+    if args.cache_dir:
+        os.makedirs(args.cache_dir, exist_ok=True)
     
-    # 3. 初始化模型
-    chat_model = ChatOpenAI(
-        model=model_name, 
-        openai_api_key=api_key,
-        openai_api_base=base_url,
-        temperature=0,
-        max_tokens=8192,
-        stop=["<|im_end|>"]
-    )
-
-    # 4. 读取 Prompt 模板
+    # 3. 读取 Prompt 模板
     prompt_path = './prompt/forecast.txt'
     if not os.path.exists(prompt_path):
         print(f"❌ 错误: 找不到 Prompt 文件 {prompt_path}")
         return
 
     with open(prompt_path, 'r', encoding='utf-8') as f:
-        prompt_template = f.read()
+        prompt = split_prompt(f.read())
 
-    # 5. 生成待处理的时间列表
+    # 4. 生成待处理的时间列表
     datelist = generate_timestamps(start_date=start_date, end_date=end_date)
     print(f"📝 预计处理 {len(datelist)} 个时次的数据")
-    
-    # 6. 主循环
-    success_count = 0
-    for day_str in tqdm.tqdm(datelist):
-        try:
-            csv_path = os.path.join(csv_dir, f'{day_str}.csv')
-            
-            if not os.path.exists(csv_path):
-                print(f"  ⚠️ 警告: {csv_path} 不存在")
-                continue
-
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                raw_csv_content = f.read()
-            
-            if not raw_csv_content:
-                continue 
-    
-            user_prompt_final = prompt_template.replace('<!INPUT!>', raw_csv_content)
-            [llm_think, final_report] = get_single_response(chat_model, user_prompt_final)
-            
-            if not final_report:
-                print(f"  ⚠️ 警告: {day_str} 生成内容为空")
-                continue
 
-            # 保存结果
-            with open(os.path.join(report_dir, f"{day_str}.txt"), "w", encoding="utf-8") as f:
-                f.write(final_report)
-            
-            if llm_think:
-                with open(os.path.join(report_dir, f"{day_str}_think.txt"), "w", encoding="utf-8") as f:
-                    f.write(llm_think)
-            
-            success_count += 1
+    # 5. 预先读入全部 CSV；清单中记录的缓存键与当前请求一致且报告仍在的时次跳过。
+    #    修改 Prompt 模板、模型或 CSV 后缓存键随之变化，对应的旧报告会重新生成
+    csvs = load_csvs(datelist, csv_dir)
+    done_count = 0
+    if not args.overwrite:
+        manifest_keys = load_manifest(report_dir)
+        unchanged = {day_str for day_str, raw_csv_content in csvs.items()
+                     if day_str in manifest_keys
+                     and manifest_keys[day_str] == cache_key(build_messages(prompt, raw_csv_content))}
+        done = existing_reports(report_dir, unchanged)
+        csvs = {day_str: raw_csv_content for day_str, raw_csv_content in csvs.items() if day_str not in done}
+        done_count = len(done)
+        if done_count:
+            print(f"⏭️ 跳过已完成的时次 {done_count} 个（使用 --overwrite 重新生成）")
 
-        except Exception as e:
-            print(f"❌ {day_str} 处理发生异常: {e}")
+    # 6. 生成报告：指定多个服务地址时按地址分片，每个地址一个进程，绕开 GIL 并同时压满多个副本
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()] if args.endpoints else []
+    if len(endpoints) > 1:
+        items = list(csvs.items())
+        shards = [(endpoint, dict(items[i::len(endpoints)]), prompt, report_dir, args)
+                  for i, endpoint in enumerate(endpoints)]
+        print(f"🖥️ 分片到 {len(endpoints)} 个服务地址并行生成")
+        with multiprocessing.Pool(len(endpoints)) as pool:
+            success_count = done_count + sum(pool.starmap(_run_shard, shards))
+    else:
+        endpoint = endpoints[0] if endpoints else base_url
+        success_count = done_count + asyncio.run(generate_reports(csvs, prompt, report_dir, args, endpoint))
                     
     print(f"--- 任务结束: 成功生成 {success_count}/{len(datelist)} 份报告 ---")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()